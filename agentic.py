@@ -1,34 +1,43 @@
 import streamlit as st
-from musicagent import run_music_agent
+from musicagent import run_music_agent, stream_trivia, fetch_lyrics
 import os
 
 st.set_page_config(page_title="🎧 Music Chatbot", layout="wide")
 st.title("🎶 Music Chatbot")
 
+# Reruns (e.g. changing the selected track) reuse the result instead of re-running the agent
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_run(q):
+    return dict(run_music_agent(q))
+
 query = st.text_input("Ask me about music or request a song:", placeholder="e.g. Play Bohemian Rhapsody or Who is Freddie Mercury")
 
 if query:
-    state = run_music_agent(query)
+    state = _cached_run(query)
     tracks = state.get("db_result", [])
-    trivia = state.get("trivia")
+    trivia_prompt = state.get("trivia_prompt")
 
-    if trivia:
+    if trivia_prompt:
         st.subheader("🎸 Music Trivia")
-        st.success(trivia)
+        # Keep only the latest answer so reruns don't re-stream it and the session doesn't grow
+        if st.session_state.get("trivia_prompt") == trivia_prompt:
+            st.write(st.session_state["trivia_answer"])
+        else:
+            st.session_state["trivia_answer"] = st.write_stream(stream_trivia(trivia_prompt))
+            st.session_state["trivia_prompt"] = trivia_prompt
 
     if tracks:
         st.subheader("🎵 Found Tracks")
 
-        track_labels = [f"{i+1}. {title} by {artist}" for i, (title, artist, path, lyrics) in enumerate(tracks)]
-
+        # Build each label in format_func; skips the intermediate label list and unused path/rowid unpacking
         selected_index = st.selectbox(
             "Select a track to play:", 
-            options=range(len(track_labels)), 
-            format_func=lambda i: track_labels[i]
+            options=range(len(tracks)), 
+            format_func=lambda i: f"{i+1}. {tracks[i][0]} by {tracks[i][1]}"
         )
 
         selected_track = tracks[selected_index]
-        title, artist, path, lyrics = selected_track
+        title, artist, path, rowid = selected_track
 
         st.markdown(f"**Now Playing:** `{title}` by `{artist}`")
 
@@ -37,10 +46,11 @@ if query:
         else:
             st.error(f"⚠️ Audio file not found: {path}")
 
+        lyrics = fetch_lyrics(rowid)
         if lyrics:
             st.markdown("### 🎤 Lyrics")
             st.text(lyrics[:1500])
         else:
             st.info("No lyrics available for this track.")
-    else:
+    elif "db_result" in state:  # pure-trivia queries never run track search
         st.warning("No tracks found for this input.")
@@ -0,0 +1,46 @@
+import sqlite3
+import sys
+
+# One-time schema migrations for music_library.db (safe to re-run):
+#   python migrate_db.py [path/to/music_library.db]
+# musicagent.py only reads the database and falls back to LIKE scans if these haven't been applied.
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, artist, lyrics, content='tracks', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS tracks_fts_ai AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts(rowid, title, artist, lyrics)
+    VALUES (new.id, new.title, new.artist, new.lyrics);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_fts_ad AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, lyrics)
+    VALUES ('delete', old.id, old.title, old.artist, old.lyrics);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_fts_au AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, lyrics)
+    VALUES ('delete', old.id, old.title, old.artist, old.lyrics);
+    INSERT INTO tracks_fts(rowid, title, artist, lyrics)
+    VALUES (new.id, new.title, new.artist, new.lyrics);
+END;
+INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild');
+"""
+
+INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_title ON tracks(title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_artist ON tracks(artist COLLATE NOCASE);
+"""
+
+def migrate(path="music_library.db"):
+    conn = sqlite3.connect(path)
+    with conn:
+        # Trigram FTS5 index over tracks, kept in sync by triggers
+        conn.executescript(FTS_SCHEMA)
+        # Case-insensitive B-tree indexes for the exact-match fast path
+        conn.executescript(INDEX_SCHEMA)
+    conn.execute("VACUUM")
+    conn.close()
+
+if __name__ == "__main__":
+    migrate(*sys.argv[1:])
+    print("✅ Migration complete.")
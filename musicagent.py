@@ -1,6 +1,11 @@
 import os
 import sqlite3
 import re
+import json
+import threading
+import httpx
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st  # ✅ for accessing secrets.toml
 from langgraph.graph import StateGraph, END
 from langchain_core.runnables import Runnable
@@ -15,16 +20,98 @@ llm = AzureChatOpenAI(
     api_key=st.secrets["AZURE_API_KEY"],
     azure_deployment=st.secrets["DEPLOYMENT_NAME"],
     api_version="2024-02-01",
-    temperature=0
+    temperature=0,
+    # Azure OpenAI has no latency-optimized inference tier to opt into; streaming is the lever
+    streaming=True,
+    # Pooled HTTP/2 keep-alive client so back-to-back calls skip the TCP/TLS handshake.
+    # Every LLM call here is sync (web lookups run on worker threads), so all of them use it.
+    http_client=httpx.Client(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+    )
 )
 
 serp_api = SerpAPIWrapper(serpapi_api_key=st.secrets["SERP_API_KEY"])
 
+# Search results are capped before prompting; prompt cost grows with input length
+_SERP_MAX_CHARS = 2000
+
+@lru_cache(maxsize=512)
+def _serp(q: str) -> str:
+    return str(serp_api.run(q))[:_SERP_MAX_CHARS]
+
+# --- Compiled Patterns ---
+_TITLE_ARTIST_RE = re.compile(r'Title:\s*(.*?)\s*\|\s*Artist:\s*(.*)')
+_TITLE_RE = re.compile(r'Title:\s*(.*)')
+_ARTIST_RE = re.compile(r'Artist:\s*(.*)')
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+_TRIVIA_RE = re.compile(r'\b(who|what|when|where|why|how|history|fact|about|born|died|trivia)\b', re.I)
+_PLAY_RE = re.compile(r'\b(play|song|track|listen)\b', re.I)
+
 
 # --- Shared Utilities ---
-def query_database(title=None, artist=None):
-    conn = sqlite3.connect("music_library.db")
-    cursor = conn.cursor()
+# One long-lived connection tuned for read-heavy lookups; the lock serializes cursor use across threads.
+# Only connection-scoped PRAGMAs here: the app never writes, and the committed DB file must stay untouched.
+_conn = sqlite3.connect("music_library.db", check_same_thread=False)
+_conn.execute("PRAGMA synchronous=NORMAL")
+_conn.execute("PRAGMA cache_size=-8000")
+_conn.execute("PRAGMA mmap_size=268435456")
+_db_lock = threading.Lock()
+
+# The trigram FTS5 index is created by migrate_db.py; without it lookups fall back to LIKE scans
+_fts_available = _conn.execute(
+    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='tracks_fts'"
+).fetchone() is not None
+
+def _build_fts_query(title=None, artist=None):
+    # Quote each word so user text can't inject FTS syntax; trigram needs 3+ chars per term
+    clauses = []
+    for column, value in (("title", title), ("artist", artist)):
+        if not value:
+            continue
+        terms = ['"' + word.replace('"', '""') + '"' for word in value.split() if len(word) >= 3]
+        if terms:
+            clauses.append(f"{column} : ({' AND '.join(terms)})")
+    return " OR ".join(clauses) or None
+
+# Upper bound on rows returned per lookup. FTS results are ordered by bm25 rank; the exact and
+# LIKE paths have no relevance order, so there it is just a cap on rows pulled into memory
+_MAX_RESULTS = 50
+
+def _run_query(query, params):
+    with _db_lock:
+        cursor = _conn.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def _exact(title=None, artist=None):
+    conditions = []
+    params = []
+    if title:
+        conditions.append("title = ? COLLATE NOCASE")
+        params.append(title)
+    if artist:
+        conditions.append("artist = ? COLLATE NOCASE")
+        params.append(artist)
+    if not conditions:
+        return []
+    query = f"SELECT title, artist, file_path, id FROM tracks WHERE {' AND '.join(conditions)} LIMIT ?"
+    return _run_query(query, (*params, _MAX_RESULTS))
+
+def _fuzzy(title=None, artist=None):
+    fts_query = _build_fts_query(title, artist) if _fts_available else None
+    if fts_query:
+        query = (
+            "SELECT t.title, t.artist, t.file_path, t.id FROM tracks t "
+            "JOIN tracks_fts f ON f.rowid = t.id WHERE tracks_fts MATCH ? ORDER BY f.rank LIMIT ?"
+        )
+        try:
+            return _run_query(query, (fts_query, _MAX_RESULTS))
+        except sqlite3.OperationalError:
+            # e.g. this SQLite build lacks FTS5 or the trigram tokenizer
+            pass
+    # No usable FTS index or terms too short for trigram: fall back to a substring scan
     conditions = []
     params = []
     if title:
@@ -33,46 +120,90 @@ def query_database(title=None, artist=None):
     if artist:
         conditions.append("artist LIKE ?")
         params.append(f"%{artist}%")
-    if conditions:
-        query = f"SELECT title, artist, file_path, lyrics FROM tracks WHERE {' OR '.join(conditions)}"
-        cursor.execute(query, tuple(params))
-        tracks = cursor.fetchall()
-    else:
-        tracks = []
-    conn.close()
-    return tracks
+    if not conditions:
+        return []
+    query = f"SELECT title, artist, file_path, id FROM tracks WHERE {' OR '.join(conditions)} LIMIT ?"
+    return _run_query(query, (*params, _MAX_RESULTS))
+
+def query_database(title=None, artist=None):
+    return _exact(title, artist) or _fuzzy(title, artist)
+
+def fetch_lyrics(rowid) -> str:
+    # Lyrics are loaded on demand for the selected track only
+    rows = _run_query("SELECT lyrics FROM tracks WHERE id = ?", (rowid,))
+    return rows[0][0] if rows and rows[0][0] else ""
+
+# Library titles without suffixes like " - Remastered", matched as whole words/phrases.
+# Built once: the app never writes to the library. Lookarounds instead of \b so titles ending
+# in punctuation ("Born In The U.S.A.") still match. A one-word title followed by a capitalized
+# word is part of a longer name ("Black Sabbath"), so it doesn't count.
+_library_titles = sorted(
+    {title.split(" - ")[0].strip() for (title,) in _run_query("SELECT title FROM tracks", ())} - {""},
+    key=len,
+    reverse=True
+)
+
+def _title_pattern(t):
+    return re.escape(t) + (r'(?!\s+(?-i:[A-Z]))' if len(t.split()) == 1 else '')
+
+_LIBRARY_TITLE_RE = re.compile(
+    r'(?<!\w)(?:' + '|'.join(_title_pattern(t) for t in _library_titles) + r')(?!\w)', re.I
+) if _library_titles else None
+
+def mentions_library_title(text) -> bool:
+    # True if the input names a library track title
+    return bool(_LIBRARY_TITLE_RE and _LIBRARY_TITLE_RE.search(text))
 
 # --- Node: ChatDetectAgent ---
-def chat_detect_agent(state):
-    user_input = state["user_input"]
+@lru_cache(maxsize=1024)
+def _classify(user_input_lower: str) -> str:
     detection_prompt = f"""
     Is the following user input asking for music-related trivia (e.g. about a person, history, or music fact)?
     Return only "trivia" or "track".
-    Input: "{user_input}"
+    Input: "{user_input_lower}"
     """
     response = llm.invoke([{"role": "user", "content": detection_prompt}])
-    category = "trivia" if "trivia" in response.content.lower() else "track"
+    return "trivia" if "trivia" in response.content.lower() else "track"
+
+def chat_detect_agent(state):
+    user_input = state["user_input"]
+    # Decide locally when exactly one rule set matches; only ambiguous input goes to the LLM
+    is_trivia = bool(_TRIVIA_RE.search(user_input))
+    is_track = bool(_PLAY_RE.search(user_input))
+    if is_trivia != is_track:
+        category = "trivia" if is_trivia else "track"
+    else:
+        category = _classify(user_input.strip().lower())
     return {**state, "query_type": category}
 
 # --- Node: DBAgent ---
 def db_agent(state):
     user_input = state["user_input"]
-    chat_response = llm.invoke([{"role": "user", "content": user_input}])
     extract_prompt = f"""
-    Extract the song title and artist from the following response.
-    Return in format: "Title: [song name] | Artist: [artist name]".
-    Response: '{chat_response.content}'
+    Extract the song title and artist from the following user input.
+    If the song is only described, identify the most likely song and artist.
+    Reply only as JSON: {{"title": "[song name]", "artist": "[artist name]"}}, using null for unknown fields.
+    Input: "{user_input}"
     """
     track_response = llm.invoke([{"role": "user", "content": extract_prompt}])
-    match = re.search(r'Title:\s*(.*?)\s*\|\s*Artist:\s*(.*)', track_response.content)
-    title = match.group(1).strip() if match else None
-    artist = match.group(2).strip() if match else None
-    if not title:
-        title_match = re.search(r'Title:\s*(.*)', track_response.content)
-        title = title_match.group(1).strip() if title_match else None
-    if not artist:
-        artist_match = re.search(r'Artist:\s*(.*)', track_response.content)
-        artist = artist_match.group(1).strip() if artist_match else None
+    title, artist = None, None
+    try:
+        # Tolerate markdown code fences or chatter around the JSON object
+        json_match = _JSON_OBJECT_RE.search(track_response.content)
+        parsed = json.loads(json_match.group(0) if json_match else track_response.content)
+        title = (parsed.get("title") or "").strip() or None
+        artist = (parsed.get("artist") or "").strip() or None
+    except (ValueError, AttributeError):
+        # Fall back to the "Title: ... | Artist: ..." format if the model ignored the JSON instruction
+        match = _TITLE_ARTIST_RE.search(track_response.content)
+        title = match.group(1).strip() if match else None
+        artist = match.group(2).strip() if match else None
+        if not title:
+            title_match = _TITLE_RE.search(track_response.content)
+            title = title_match.group(1).strip() if title_match else None
+        if not artist:
+            artist_match = _ARTIST_RE.search(track_response.content)
+            artist = artist_match.group(1).strip() if artist_match else None
     tracks = query_database(title, artist)
     return {
         **state,
@@ -82,6 +213,32 @@ def db_agent(state):
     }
 
 # --- Node: WebSearchAgent ---
+def _lookup(q):
+    results = _serp(q)
+    extraction_prompt = f"""
+    Extract a relevant song title and artist from the search results below:
+    Format: "Title: [song name] | Artist: [artist name]"
+    Results: {results}
+    """
+    response = llm.invoke([{"role": "user", "content": extraction_prompt}])
+    match = _TITLE_ARTIST_RE.search(response.content)
+    return (match.group(1).strip(), match.group(2).strip()) if match else None
+
+def _search_web(queries):
+    # Fetch all queries concurrently on worker threads (sync calls share the pooled client and
+    # need no event loop), then check them in priority order so results are deterministic
+    new_title, new_artist = None, None
+    new_tracks = []
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        lookups = list(executor.map(_lookup, queries))
+    for extracted in lookups:
+        if extracted:
+            new_title, new_artist = extracted
+            new_tracks = query_database(new_title, new_artist)
+            if new_tracks:
+                break
+    return new_title, new_artist, new_tracks
+
 def web_search_agent(state):
     title = state.get("extracted_title")
     artist = state.get("extracted_artist")
@@ -93,23 +250,7 @@ def web_search_agent(state):
         queries.append(f"songs by {artist}")
     if not title and not artist:
         queries.append(user_input)
-    new_title, new_artist = None, None
-    new_tracks = []
-    for q in queries:
-        results = serp_api.run(q)
-        extraction_prompt = f"""
-        Extract a relevant song title and artist from the search results below:
-        Format: "Title: [song name] | Artist: [artist name]"
-        Results: {results}
-        """
-        response = llm.invoke([{"role": "user", "content": extraction_prompt}])
-        match = re.search(r'Title:\s*(.*?)\s*\|\s*Artist:\s*(.*)', response.content)
-        if match:
-            new_title = match.group(1).strip()
-            new_artist = match.group(2).strip()
-            new_tracks = query_database(new_title, new_artist)
-            if new_tracks:
-                break
+    new_title, new_artist, new_tracks = _search_web(queries)
     return {
         **state,
         "extracted_title": new_title,
@@ -117,48 +258,40 @@ def web_search_agent(state):
         "db_result": new_tracks
     }
 
-# --- Node: LyricsAgent (DB only) ---
-def lyrics_agent(state):
-    tracks = state.get("db_result", [])
-
-    # For each track, ensure lyrics are present or set a placeholder
-    updated_tracks = []
-    for title, artist, path, lyrics in tracks:
-        updated_tracks.append((
-            title,
-            artist,
-            path,
-            lyrics or "Lyrics not available in database."
-        ))
-
-    return {
-        **state,
-        "db_result": updated_tracks
-    }
-
 # --- Node: TriviaAgent ---
 def trivia_agent(state):
     user_input = state.get("user_input", "")
-    search_results = serp_api.run(user_input)
+    search_results = _serp(user_input)
     trivia_prompt = f"""
     Based on the following search results, answer the user's music-related question or provide a fun fact.
     Be concise, accurate, and conversational.
     Results: {search_results}
     """
-    trivia_response = llm.invoke([{"role": "user", "content": trivia_prompt}])
+    # The answer itself is streamed by the caller via stream_trivia()
     return {
         **state,
-        "trivia": trivia_response.content.strip()
+        "trivia_prompt": trivia_prompt
     }
 
+def stream_trivia(trivia_prompt, min_chunk_chars=40):
+    # Batch tokens into larger pieces so the UI isn't re-rendered for every token
+    buffer = ""
+    for chunk in llm.stream([{"role": "user", "content": trivia_prompt}]):
+        buffer += chunk.content
+        if len(buffer) >= min_chunk_chars:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
 # --- Graph State ---
 class GraphState(TypedDict):
     user_input: str
     query_type: Optional[str]
     extracted_title: Optional[str]
     extracted_artist: Optional[str]
-    db_result: Optional[List[Tuple[str, str, str, str]]]
-    trivia: Optional[str]
+    db_result: Optional[List[Tuple[str, str, str, int]]]
+    trivia_prompt: Optional[str]
 
 # --- Build Graph ---
 graph = StateGraph(GraphState)
@@ -167,37 +300,50 @@ graph.add_node("DetectType", chat_detect_agent)
 graph.add_node("TriviaSearch", trivia_agent)
 graph.add_node("DBSearch", db_agent)
 graph.add_node("WebSearch", web_search_agent)
-graph.add_node("LyricsSearch", lyrics_agent)
 
 # Flow Logic
 graph.set_entry_point("DetectType")
 
 graph.add_conditional_edges("DetectType", lambda s: "TriviaSearch" if s["query_type"] == "trivia" else "DBSearch")
-graph.add_edge("TriviaSearch", "DBSearch")  # trivia-first flow
-graph.add_conditional_edges("DBSearch", lambda s: "WebSearch" if not s["db_result"] else "LyricsSearch")
-graph.add_edge("WebSearch", "LyricsSearch")
-graph.add_edge("LyricsSearch", END)
+# trivia-first flow; only continue to track search when the query asks for or names a song
+graph.add_conditional_edges(
+    "TriviaSearch",
+    lambda s: "DBSearch" if _PLAY_RE.search(s["user_input"]) or mentions_library_title(s["user_input"]) else END
+)
+graph.add_conditional_edges("DBSearch", lambda s: "WebSearch" if not s["db_result"] else END)
+graph.add_edge("WebSearch", END)
 
 # Finalize
 graph_app = graph.compile()
 
+# Warm the compiled graph so the first real request doesn't pay setup costs.
+# "play" is classified locally (no LLM call) and the recursion limit stops it after DetectType.
+try:
+    graph_app.invoke({"user_input": "play"}, config={"recursion_limit": 1})
+except Exception:
+    pass
+
 # --- Main Execution ---
 if __name__ == "__main__":
     user_query = input("Ask a music question: ")
     final_state = graph_app.invoke({"user_input": user_query})
 
     tracks = final_state.get("db_result", [])
-    trivia = final_state.get("trivia")
+    trivia_prompt = final_state.get("trivia_prompt")
 
-    if trivia:
-        print("\n🎧 Trivia:\n" + trivia)
+    if trivia_prompt:
+        print("\n🎧 Trivia:")
+        for piece in stream_trivia(trivia_prompt):
+            print(piece, end="", flush=True)
+        print()
 
     if tracks:
         print("\n🎵 Found Tracks:")
-        for title, artist, path, lyrics in tracks:
+        for title, artist, path, rowid in tracks:
+            lyrics = fetch_lyrics(rowid) or "Lyrics not available in database."
             print(f"- {title} by {artist}")
             print(f"  🎤 Lyrics:\n{lyrics[:500]}...\n")
-    else:
+    elif "db_result" in final_state:  # pure-trivia queries never run track search
         print("\n😢 No tracks found.")
 
 def run_music_agent(user_query: str):